@@ -9,14 +9,61 @@ Expense Report OCR（批量版，手机可用）
 - 结果汇总为一张表并提供 Excel 下载
 """
 
+import os
+import queue
 import re
+import shlex
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
 from io import BytesIO
-from typing import Dict, List, Tuple
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# 每个 Tesseract 进程只用单线程，多文件并行时避免 OpenMP 线程互相争抢
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit.runtime.uploaded_file_manager import UploadedFile
+import numpy as np
 import pandas as pd
-from PIL import Image, ImageOps, ImageFilter
+from PIL import Image, ImageOps, ImageSequence
 import pytesseract
 import pdfplumber
+import pypdfium2 as pdfium
+
+try:  # 可选：Hyperscan（DFA 多模式同时扫描），未安装时全部走 re
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:  # 可选：tesserocr 进程内调用 libtesseract，免去每张图起子进程、重载语言包；未安装时走 pytesseract
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# ---------------- 参数 ----------------
+# 图片 OCR 预处理
+_IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+# 只有 TIFF 逐帧识别；JPEG 的 MPF 附图（相机预览、HDR 增益图）等其他格式的附加帧不是正文，只取首帧
+_MULTI_FRAME_SUFFIXES = (".tif", ".tiff")
+_OCR_MIN_WIDTH = 1200
+_OCR_MAX_WIDTH = 2400
+# 高分辨率且对比度足够（如 300dpi 扫描件）时跳过二值化，直接送灰度图
+_OCR_FAST_MIN_WIDTH = 1800
+_OCR_FAST_MIN_STD = 50
+# 金额前的 ￥、名字后的中文括注需要 chi_sim 才能识别，不限定字符集
+_TESS_LANG = "eng+chi_sim"
+# 不关闭 Tesseract 的反色检查：二值化保留原图极性，深色底白字（如彩色标题栏）靠它识别
+_TESS_CONFIG = "--psm 6"
+
+# 文字层为空的页视为扫描件：渲染成图片后 OCR
+_PDF_OCR_SCALE = 2             # 渲染倍数（72dpi × 2，A4/Letter 宽约 1200px）
+
+# 识别结果缓存：每次上传都是新的 file_id，限制条数防止服务器内存无限增长
+_CACHE_MAX_ENTRIES = 256
 
 # ---------------- 页面配置（手机友好） ----------------
 st.set_page_config(page_title="Expense OCR (Batch)", page_icon="📄", layout="centered")
@@ -32,68 +79,370 @@ st.markdown(
 st.title("📄 Expense Report OCR（批量识别）")
 st.caption("上传 PDF 或图片（可多选），自动识别：报销单号 / QC name（两个英文单词）/ 金额，并导出合并 Excel。")
 
+# ---------------- 字段正则（模块加载时预编译） ----------------
+_CN_PAREN_RE = re.compile(r"（.*?）")
+_EN_WORD_RE = re.compile(r"[A-Za-z]+")
+# 单次扫描：标题行 "Expense Report[ Number]: SHPC-XXXXXX" 与 "for ￥3,847.08"
+# QC name 只在 "Expense Report: SHPC-XXXXXX, NAME, on ..." 时取；单号与名字都放在前瞻里，
+# 只消耗 "Expense Report"——finditer 的匹配互不重叠，否则其后的 "for ￥..." 可能被吞掉
+_FIELDS_RE = re.compile(
+    r"Expense Report"
+    r"(?:(?=[:\s]+SHPC-[A-Za-z0-9]+,\s*(?P<name>.+?)\s*,?\s*on\b))?"
+    r"(?=(?: Number)?[:\s]+(?P<report_no>SHPC-[A-Za-z0-9]+))"
+    r"|for\s*[￥¥]?\s*(?P<amount>[0-9,]+\.[0-9]{2})",
+    re.IGNORECASE,
+)
+# 兜底：直接找 SHPC-XXXX / Report Owner、QC Name 标签 / Reimbursement、Total Amount
+_REPORT_NO_FALLBACK_RE = re.compile(r"\b(SHPC-[A-Za-z0-9]+)\b")
+_OWNER_RE = re.compile(r"(?:Report Owner|QC Name?)[:\s]+(.+)", re.IGNORECASE)
+_AMT_FALLBACK_RE = re.compile(r"(?:Reimbursement|Total Amount)[:\s]+(?:CNY|[￥¥])?\s*([0-9,]+\.[0-9]{2})", re.IGNORECASE)
+
+# Hyperscan 预筛：同一遍扫描给出各规则首次命中位置，未命中的规则直接跳过 re
+# （Hyperscan 不支持捕获组，字段值仍由上面的 re 在命中位置提取）
+_HS_TITLE, _HS_AMOUNT, _HS_REPORT_NO, _HS_OWNER, _HS_AMT_FALLBACK = range(5)
+_HS_PATTERNS = [
+    (_HS_TITLE, r"Expense Report(?: Number)?[:\s]+SHPC-[A-Za-z0-9]+", True),
+    (_HS_AMOUNT, r"for\s*[￥¥]?\s*[0-9,]+\.[0-9]{2}", True),
+    (_HS_REPORT_NO, r"SHPC-[A-Za-z0-9]+", False),   # UCP 模式不支持 \b，放宽即可（re 会再校验）
+    (_HS_OWNER, r"(?:Report Owner|QC Name?)[:\s]+.", True),
+    (_HS_AMT_FALLBACK, r"(?:Reimbursement|Total Amount)[:\s]+(?:CNY|[￥¥])?\s*[0-9,]+\.[0-9]{2}", True),
+]
+
+# Streamlit 每次交互都会重跑脚本：Hyperscan 库与 tesserocr API 池用 cache_resource 跨重跑复用
+@st.cache_resource(show_spinner=False)
+def _get_hs_db():
+    """编译 Hyperscan 数据库（只编译一次）；未安装时返回 None"""
+    if hyperscan is None:
+        return None
+    base = hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP | hyperscan.HS_FLAG_SOM_LEFTMOST
+    db = hyperscan.Database()
+    db.compile(
+        expressions=[pat.encode("utf-8") for _, pat, _ in _HS_PATTERNS],
+        ids=[pid for pid, _, _ in _HS_PATTERNS],
+        elements=len(_HS_PATTERNS),
+        flags=[base | (hyperscan.HS_FLAG_CASELESS if caseless else 0) for _, _, caseless in _HS_PATTERNS],
+    )
+    return db
+
+_hs_local = threading.local()   # scratch 不能跨线程共用，每个线程一份
+
+def _hs_first_hits(text: str) -> Optional[Dict[int, int]]:
+    """返回 {规则 id: 首次命中的字符位置}；无 Hyperscan 时返回 None"""
+    db = _get_hs_db()
+    if db is None:
+        return None
+    scratch = getattr(_hs_local, "scratch", None)
+    if scratch is None:
+        scratch = _hs_local.scratch = hyperscan.Scratch(db)
+    data = text.encode("utf-8")
+    hits: Dict[int, int] = {}
+
+    def on_match(pid, start, end, flags, context):
+        if pid not in hits or start < hits[pid]:
+            hits[pid] = start
+
+    db.scan(data, match_event_handler=on_match, scratch=scratch)
+    # 字节偏移 -> 字符偏移
+    return {pid: len(data[:start].decode("utf-8")) for pid, start in hits.items()}
+
 # ---------------- 工具函数 ----------------
 def _clean_name_english(name: str) -> str:
     """只保留英文名两个单词，去掉中文括注等"""
-    name = re.sub(r"（.*?）", "", name)                  # 去中文括注
-    words = re.findall(r"[A-Za-z]+", name)              # 只保留英文字母
+    name = _CN_PAREN_RE.sub("", name)                   # 去中文括注
+    words = _EN_WORD_RE.findall(name)                   # 只保留英文字母
     return " ".join(words[:2]).strip()                  # 最多两个单词
 
-def _ocr_image(img: Image.Image) -> str:
-    """图片 OCR（轻量预处理，提高手机拍照识别稳定性）"""
-    # 修正 EXIF 方向、转灰度、增强对比度、轻微锐化
+def _otsu_threshold(hist: np.ndarray) -> int:
+    """Otsu 阈值：256 档灰度直方图上类间方差最大的分割点（全程向量化）"""
+    hist = np.asarray(hist, dtype=np.float64)
+    w0 = np.cumsum(hist)                       # 阈值以下像素数
+    m0 = np.cumsum(hist * np.arange(256))      # 阈值以下灰度和
+    total, mt = w0[-1], m0[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var = (mt * w0 - total * m0) ** 2 / (w0 * (total - w0))
+    return int(np.argmax(np.nan_to_num(var, nan=0.0, posinf=0.0)))
+
+def _new_tess_api() -> "tesserocr.PyTessBaseAPI":
+    """新建一个 tesserocr API（中英文，psm 6 适合块状文本）"""
+    return tesserocr.PyTessBaseAPI(lang=_TESS_LANG, psm=tesserocr.PSM.SINGLE_BLOCK)
+
+@st.cache_resource(show_spinner=False)
+def _get_tess_api_pool() -> Optional["queue.SimpleQueue"]:
+    """tesserocr API 池：语言包只加载一次；单个 API 非线程安全，同一时刻只借给一个线程
+    未安装或初始化失败（如 pip 版找不到系统 tessdata）时返回 None，此后一律走 pytesseract"""
+    if tesserocr is None:
+        return None
+    try:
+        api = _new_tess_api()   # 先试建一个：失败只发生一次，结果随池一起缓存
+    except RuntimeError:
+        return None
+    pool = queue.SimpleQueue()
+    pool.put(api)
+    return pool
+
+@contextmanager
+def _tess_api(pool: "queue.SimpleQueue"):
+    """从池中借一个 PyTessBaseAPI，用完归还；池空时新建"""
+    try:
+        api = pool.get_nowait()
+    except queue.Empty:
+        api = _new_tess_api()
+    try:
+        yield api
+    finally:
+        pool.put(api)
+
+def _tesseract(img: Image.Image) -> str:
+    """Tesseract 识别：优先 tesserocr，不可用时 pytesseract 子进程"""
+    pool = _get_tess_api_pool()
+    if pool is None:
+        return pytesseract.image_to_string(img, lang=_TESS_LANG, config=_TESS_CONFIG)
+    with _tess_api(pool) as api:
+        api.SetImage(img)
+        return api.GetUTF8Text()
+
+def _preprocess_image(img: Image.Image) -> Image.Image:
+    """OCR 前的轻量预处理，提高手机拍照识别稳定性"""
+    # 修正 EXIF 方向、转灰度（后面 Otsu 二值化与线性拉伸无关，无需再 autocontrast）
     img = ImageOps.exif_transpose(img)
     img = ImageOps.grayscale(img)
-    img = ImageOps.autocontrast(img)
-    img = img.filter(ImageFilter.SHARPEN)
-    # 分辨率过小则放大到宽至少 1200px
-    if img.width < 1200:
-        ratio = 1200 / img.width
-        img = img.resize((int(img.width * ratio), int(img.height * ratio)), Image.LANCZOS)
-    # Tesseract OCR（中英文，psm 6 适合块状文本）
-    return pytesseract.image_to_string(img, lang="eng+chi_sim", config="--psm 6")
-
-def _read_text_from_bytes(file_bytes: bytes, suffix: str) -> str:
-    """同时支持 PDF 与图片，返回整份文本"""
+    # 宽度调整到 [1200, 2400] px：过小放大保证字形，手机原图过大则缩小以加快识别
+    if img.width < _OCR_MIN_WIDTH or img.width > _OCR_MAX_WIDTH:
+        ratio = min(max(img.width, _OCR_MIN_WIDTH), _OCR_MAX_WIDTH) / img.width
+        img = img.resize((int(img.width * ratio), int(img.height * ratio)), Image.BILINEAR)
+    # 直方图取 PIL 的 C 实现（比 np.bincount 快得多），快速通道判断与 Otsu 共用
+    hist = np.asarray(img.histogram(), dtype=np.float64)
+    if img.width >= _OCR_FAST_MIN_WIDTH:
+        levels = np.arange(256)
+        mean = (hist * levels).sum() / hist.sum()
+        std = np.sqrt((hist * (levels - mean) ** 2).sum() / hist.sum())
+        if std > _OCR_FAST_MIN_STD:
+            return img
+    # Otsu 二值化（替代锐化），Tesseract 处理黑白图更快更稳
+    # 比较结果原地乘 255，只分配一份缓冲区
+    binary = np.greater(np.asarray(img), _otsu_threshold(hist)).view(np.uint8)
+    binary *= 255
+    return Image.fromarray(binary)
+
+def _ocr_image(img: Image.Image) -> str:
+    """图片 OCR：预处理后交给 Tesseract（中英文，psm 6 适合块状文本）"""
+    return _tesseract(_preprocess_image(img))
+
+def _ocr_images_batch(images: List[Image.Image]) -> List[str]:
+    """一次 tesseract 调用识别多张图（图片列表文件模式，只初始化一次），按换页符拆回各图文本"""
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i, img in enumerate(images):
+            paths.append(os.path.join(tmp, f"{i}.png"))
+            img.save(paths[-1])
+        list_path = os.path.join(tmp, "imglist.txt")
+        with open(list_path, "w", encoding="utf-8") as fh:
+            fh.write("\n".join(paths) + "\n")
+        # 直接调用 tesseract 且 stdin 置空，避开 pytesseract 列表模式可能卡住的问题
+        proc = subprocess.run(
+            [pytesseract.pytesseract.tesseract_cmd, list_path, "stdout",
+             "-l", _TESS_LANG, *shlex.split(_TESS_CONFIG)],
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+        )
+    # 各图文本以换页符 \f 分隔：Tesseract 5 只写在图与图之间（N 段），4.x 每张图后都写（N+1 段，末段为空）
+    texts = proc.stdout.decode("utf-8", errors="replace").split("\x0c")
+    if proc.returncode != 0 or len(texts) < len(images):
+        return [_tesseract(img) for img in images]   # 批量失败则逐张兜底
+    return texts[:len(images)]
+
+# PDFium 全局非线程安全：本进程内所有 pdfium 调用都需持锁
+_PDFIUM_LOCK = threading.Lock()
+
+def _pdfium_page_texts(pdf: "pdfium.PdfDocument", start: int, stop: int) -> List[str]:
+    """PDFium 提取第 [start, stop) 页文本（调用方持锁）"""
+    texts = []
+    for i in range(start, stop):
+        page = pdf[i]
+        textpage = page.get_textpage()
+        texts.append(textpage.get_text_bounded().replace("\r\n", "\n"))
+        textpage.close()
+        page.close()
+    return texts
+
+def _render_pdf_page(pdf: "pdfium.PdfDocument", index: int) -> Image.Image:
+    """把 PDF 页渲染成灰度图供 OCR（调用方持锁）"""
+    page = pdf[index]
+    try:
+        return page.render(scale=_PDF_OCR_SCALE, grayscale=True).to_pil()
+    finally:
+        page.close()
+
+def _iter_pdf_pages_plumber(file_obj: BinaryIO) -> Iterator[str]:
+    """兜底：PDFium 打不开的文件改用 pdfplumber，逐页产出文本"""
+    file_obj.seek(0)
+    with pdfplumber.open(file_obj) as pdf:
+        for page in pdf.pages:
+            yield page.extract_text() or ""
+
+def _iter_pdf_pages(file_obj: BinaryIO) -> Iterator[str]:
+    """逐页产出 PDF 文本（PDFium 直接读文件流，C 实现逐页提取已足够快）；无文字层的页改走 OCR"""
+    try:
+        with _PDFIUM_LOCK:
+            file_obj.seek(0)
+            pdf = pdfium.PdfDocument(file_obj)
+            n_pages = len(pdf)
+    except pdfium.PdfiumError:
+        yield from _iter_pdf_pages_plumber(file_obj)
+        return
+    try:
+        for i in range(n_pages):
+            # 只在调用 PDFium 时持锁，不跨 yield；OCR 在锁外进行
+            with _PDFIUM_LOCK:
+                text = _pdfium_page_texts(pdf, i, i + 1)[0]
+                page_img = _render_pdf_page(pdf, i) if not text.strip() else None
+            if page_img is not None:
+                text = _ocr_image(page_img)   # 扫描件（无文字层）：渲染后 OCR
+            yield text
+    finally:
+        with _PDFIUM_LOCK:
+            pdf.close()
+
+def _iter_text_pages(file_obj: BinaryIO, suffix: str) -> Iterator[str]:
+    """同时支持 PDF 与图片（含多页 TIFF），直接从文件流读取，按页惰性产出文本"""
     suffix = suffix.lower()
     if suffix == ".pdf":
-        chunks = []
-        with pdfplumber.open(BytesIO(file_bytes)) as pdf:
-            for page in pdf.pages:
-                chunks.append(page.extract_text() or "")
-        return "\n".join(chunks)
-    elif suffix in (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff"):
-        img = Image.open(BytesIO(file_bytes))
-        return _ocr_image(img)
-    else:
-        return ""
+        yield from _iter_pdf_pages(file_obj)
+    elif suffix in _IMAGE_SUFFIXES:
+        file_obj.seek(0)
+        img = Image.open(file_obj)
+        if suffix in _MULTI_FRAME_SUFFIXES:
+            for frame in ImageSequence.Iterator(img):
+                yield _ocr_image(frame)
+        else:
+            yield _ocr_image(img)
+
+def _hit_pos(hits: Optional[Dict[int, int]], pid: int) -> Optional[int]:
+    """规则 pid 的 re 起始位置：无 Hyperscan 时从 0 开始，预筛未命中时为 None（跳过）"""
+    return 0 if hits is None else hits.get(pid)
+
+def _extract_primary(text: str, hits: Optional[Dict[int, int]]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """主规则（标题行 / "for ￥"）一次扫描，返回 (report_no, qc_name, amount)；未命中的项为 None
+    （QC name 命中但清洗后为空时为 ""，按原逻辑应改走兜底）"""
+    found: Dict[str, str] = {}
+    starts = [p for p in (_hit_pos(hits, _HS_TITLE), _hit_pos(hits, _HS_AMOUNT)) if p is not None]
+    if starts:
+        # 各字段取首次命中，三项齐全即停止
+        for m in _FIELDS_RE.finditer(text, min(starts)):
+            for key, value in m.groupdict().items():
+                if value is not None:
+                    found.setdefault(key, value)
+            if len(found) == 3:
+                break
+    name = found.get("name")
+    return found.get("report_no"), None if name is None else _clean_name_english(name), found.get("amount")
 
 def _extract_fields(text: str) -> Tuple[str, str, str]:
     """返回 (report_no, qc_name, amount) —— 含兜底规则"""
-    # 报销单号：标题行或“Expense Report Number:”
-    m_no = re.search(r"(?:Expense Report(?: Number)?[:\s]+)(SHPC-[A-Za-z0-9]+)", text, re.IGNORECASE)
-    if not m_no:
-        m_no = re.search(r"\b(SHPC-[A-Za-z0-9]+)\b", text)   # 再兜底
-    report_no = m_no.group(1) if m_no else ""
-
-    # QC name：标题行 "... SHPC-XXXXXX, NAME, on ..."
-    m_name = re.search(r"Expense Report[:\s]+SHPC-[A-Za-z0-9]+,\s*(.+?)\s*,?\s*on\b", text, re.IGNORECASE)
-    qc_name = _clean_name_english(m_name.group(1)) if m_name else ""
-    if not qc_name:
-        # 兜底：Report Owner / QC Name 标签
-        m_owner = re.search(r"(?:Report Owner|QC Name?)[:\s]+(.+)", text, re.IGNORECASE)
+    # 有 Hyperscan 时先预筛：只对命中的规则、从首次命中位置起跑 re
+    hits = _hs_first_hits(text)
+    report_no, qc_name, amount = (value or "" for value in _extract_primary(text, hits))
+
+    # 报销单号：兜底直接找 SHPC-XXXX
+    pos = _hit_pos(hits, _HS_REPORT_NO)
+    if not report_no and pos is not None:
+        m_no = _REPORT_NO_FALLBACK_RE.search(text, pos)
+        report_no = m_no.group(1) if m_no else ""
+
+    # QC name：兜底 Report Owner / QC Name 标签
+    pos = _hit_pos(hits, _HS_OWNER)
+    if not qc_name and pos is not None:
+        m_owner = _OWNER_RE.search(text, pos)
         if m_owner:
             qc_name = _clean_name_english(m_owner.group(1))
 
-    # 金额：标题行 "for ￥3,847.08"；兜底 Reimbursement/Total Amount
-    m_amt = re.search(r"for\s*￥?\s*([0-9,]+\.[0-9]{2})", text, re.IGNORECASE)
-    amount = m_amt.group(1) if m_amt else ""
-    if not amount:
-        m_amt2 = re.search(r"(?:Reimbursement|Total Amount)[:\s]+(?:CNY|￥)?\s*([0-9,]+\.[0-9]{2})", text, re.IGNORECASE)
+    # 金额：兜底 Reimbursement/Total Amount
+    pos = _hit_pos(hits, _HS_AMT_FALLBACK)
+    if not amount and pos is not None:
+        m_amt2 = _AMT_FALLBACK_RE.search(text, pos)
         amount = m_amt2.group(1) if m_amt2 else ""
 
     return report_no, qc_name, amount
 
+def _extract_fields_streaming(pages: Iterable[str]) -> Tuple[str, Tuple[str, str, str]]:
+    """逐页读取；三项都已由主规则命中即不再读取后续页；返回 (已读文本, 字段)"""
+    # 只有主规则结果能提前确定：兜底规则的优先级低于任何位置的主规则命中，
+    # 前面页的兜底命中可能被后面页的标题行覆盖，因此不参与提前结束
+    seen: List[str] = []
+    primary: List[Optional[str]] = [None, None, None]
+    for page_text in pages:
+        seen.append(page_text)
+        # 连同上一页一起扫描，跨页边界的标题行也能命中
+        window = "\n".join(seen[-2:])
+        page_primary = _extract_primary(window, _hs_first_hits(window))
+        primary = [old if old is not None else new for old, new in zip(primary, page_primary)]
+        if all(primary):
+            return "\n".join(seen), tuple(primary)
+    # 读完全部页：按整份文本抽取（含兜底规则，与原逻辑一致）
+    text = "\n".join(seen)
+    return text, _extract_fields(text)
+
+@st.cache_data(show_spinner=False, max_entries=_CACHE_MAX_ENTRIES)
+def _cached_result(_file_obj: BinaryIO, file_id: str, suffix: str) -> Tuple[str, Tuple[str, str, str]]:
+    """按上传文件 id 缓存 (文本, 字段)：点击下载等触发重跑时不再重复 OCR（文件流本身不参与哈希）"""
+    with closing(_iter_text_pages(_file_obj, suffix)) as pages:
+        return _extract_fields_streaming(pages)
+
+@st.cache_data(show_spinner=False, max_entries=_CACHE_MAX_ENTRIES)
+def _cached_batch_texts(_files: List[UploadedFile], file_ids: Tuple[str, ...]) -> List[str]:
+    """按一组图片的上传文件 id 缓存批量 OCR 结果"""
+    images = []
+    for f in _files:
+        f.seek(0)
+        images.append(_preprocess_image(Image.open(f)))
+    return _ocr_images_batch(images)
+
+def _is_single_frame(f: UploadedFile, suffix: str) -> bool:
+    """是否按单帧识别（只读文件头）；多页 TIFF 需逐帧识别，不进批量模式"""
+    f.seek(0)
+    try:
+        with Image.open(f) as img:
+            return suffix not in _MULTI_FRAME_SUFFIXES or getattr(img, "n_frames", 1) == 1
+    except OSError:
+        return False   # 打不开的交给逐个识别路径报错
+
+def _read_all(files: List[UploadedFile]) -> List[Tuple[str, Tuple[str, str, str]]]:
+    """并行识别全部上传文件，按上传顺序返回 (文本, 字段)"""
+    workers = min(len(files), os.cpu_count() or 1)
+    suffixes = ["." + f.name.split(".")[-1] for f in files]
+    # 走 pytesseract 且单帧图片多于线程数时，图片分成 workers 组，每组只起一次 tesseract
+    image_idx = [
+        i for i, suffix in enumerate(suffixes)
+        if _get_tess_api_pool() is None and suffix.lower() in _IMAGE_SUFFIXES
+        and _is_single_frame(files[i], suffix.lower())
+    ]
+    batched = image_idx if len(image_idx) > workers else []
+    groups = [batched[k::workers] for k in range(workers)] if batched else []
+    in_batch = set(batched)
+
+    results: List[Tuple[str, Tuple[str, str, str]]] = [("", ("", "", ""))] * len(files)
+    # OCR 在 tesseract 子进程或 tesserocr（释放 GIL）中进行，线程池即可让多个文件真正并行
+    # 工作线程挂上当前 ScriptRunContext，st.cache_data 才能在线程里正常使用
+    with ThreadPoolExecutor(
+        max_workers=workers,
+        initializer=add_script_run_ctx,
+        initargs=(None, get_script_run_ctx()),
+    ) as ex:
+        singles = {
+            i: ex.submit(_cached_result, f, f.file_id, suffixes[i])
+            for i, f in enumerate(files) if i not in in_batch
+        }
+        grouped = [
+            (group, ex.submit(_cached_batch_texts, [files[i] for i in group], tuple(files[i].file_id for i in group)))
+            for group in groups
+        ]
+        for i, fut in singles.items():
+            results[i] = fut.result()
+        for group, fut in grouped:
+            for i, text in zip(group, fut.result()):
+                results[i] = (text, _extract_fields(text))
+    return results
+
 # ---------------- 上传与批量处理 ----------------
 uploads = st.file_uploader(
     "上传 Expense Report（PDF/图片，可多选；手机可直接拍照或选相册）",
@@ -102,27 +451,31 @@ uploads = st.file_uploader(
 )
 
 if uploads:
-    rows: List[Dict[str, str]] = []
+    # 按列收集结果，直接构建 DataFrame，免去逐行 dict 再转置
+    report_nos: List[str] = []
+    qc_names: List[str] = []
+    amounts: List[str] = []
     with st.status("正在识别…", expanded=False) as status:
-        for f in uploads:
-            suffix = "." + f.name.split(".")[-1]
-            text = _read_text_from_bytes(f.getvalue(), suffix)
-            report_no, qc_name, amount = _extract_fields(text)
-            rows.append({
-                "Expense Report Number": report_no,
-                "QC name": qc_name,
-                "Amount": amount,
-            })
+        results = _read_all(uploads)
+        texts = [text for text, _ in results]
+        for _, (report_no, qc_name, amount) in results:
+            report_nos.append(report_no)
+            qc_names.append(qc_name)
+            amounts.append(amount)
         status.update(label="识别完成", state="complete")
 
     # 预览
     st.subheader("识别结果预览（合并表）")
-    df = pd.DataFrame(rows, columns=["Expense Report Number", "QC name", "Amount"])
+    df = pd.DataFrame({
+        "Expense Report Number": report_nos,
+        "QC name": qc_names,
+        "Amount": amounts,
+    })
     st.dataframe(df, use_container_width=True)
 
     # 下载合并 Excel
     bio = BytesIO()
-    with pd.ExcelWriter(bio, engine="openpyxl") as writer:
+    with pd.ExcelWriter(bio, engine="xlsxwriter") as writer:
         df.to_excel(writer, index=False)
     bio.seek(0)
     st.download_button(
@@ -132,11 +485,9 @@ if uploads:
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
 
-    # 调试：原始文本片段（可折叠）
+    # 调试：原始文本片段（可折叠）——直接复用上面已识别的文本
     with st.expander("调试：原始文本片段（每份文件取前 2,000 字）"):
-        for i, f in enumerate(uploads, start=1):
-            suffix = "." + f.name.split(".")[-1]
-            text = _read_text_from_bytes(f.getvalue(), suffix)
+        for i, (f, text) in enumerate(zip(uploads, texts), start=1):
             st.markdown(f"**文件 {i}: {f.name}**")
             st.code(text[:2000] + ("\n...\n" if len(text) > 2000 else ""), language="text")
 